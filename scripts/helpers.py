@@ -1,10 +1,120 @@
 import os
 import re
-import pandas as pd
+import json
+import logging
+import atexit
+import hashlib
+import itertools
+import time
+import threading
+import httpx
+import numpy as np
+import sqlglot
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from functools import lru_cache
 from dotenv import load_dotenv
 from sqlalchemy import create_engine, inspect, text
+from sqlglot import exp
+from sqlglot.dialects.dialect import Dialect
 from openai import OpenAI
 
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Konfigurasi LLM dan database dibaca sekali saat import, bukan di setiap request
+LLM_MODEL_NAME = os.getenv("LLM_MODEL_NAME")
+LLM_BASE_URL = os.getenv("LLM_BASE_URL")
+LLM_API_KEY = os.getenv("LLM_API_KEY")
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+# prompt_cache_key hanya ada di API OpenAI; provider OpenAI-compatible yang ketat
+# menolak field yang tidak dikenal, jadi hanya dikirim jika diaktifkan
+LLM_PROMPT_CACHE_KEY = os.getenv("LLM_PROMPT_CACHE_KEY", "").lower() in ("1", "true")
+
+# Seed untuk output deterministik (bersama temperature 0), hanya dikirim jika diset
+LLM_SEED = int(os.getenv("LLM_SEED")) if os.getenv("LLM_SEED") else None
+
+# Batas jumlah baris hasil query, ditambahkan sebagai LIMIT jika query belum punya
+MAX_ROWS = int(os.getenv("MAX_ROWS") or 1000)
+
+# Shared HTTP client supaya koneksi (TCP + TLS) ke LLM endpoint di-reuse antar request
+_http_client = None
+
+# Koneksi idle di pool ditutup setelah waktu ini (detik)
+HTTP_KEEPALIVE_EXPIRY = 120.0
+
+# Timeout ping pre-warm / keepalive (detik), endpoint yang mati tidak menahan startup
+HTTP_PING_TIMEOUT = 5.0
+
+# Exact-match LRU cache untuk respons LLM, key: hash (fungsi, model, pertanyaan, schema)
+RESPONSE_CACHE_MAXSIZE = 1024
+_response_cache = OrderedDict()
+_response_cache_lock = threading.Lock()
+
+# Semantic cache intent: pertanyaan yang mirip (cosine >= threshold) memakai label
+# yang sama tanpa panggilan chat completion. Nonaktif jika EMBEDDING_MODEL_NAME kosong
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME")
+SEMANTIC_CACHE_DIR = ".intent_cache"
+SEMANTIC_CACHE_THRESHOLD = 0.92
+SEMANTIC_CACHE_MAXSIZE = 10000
+SEMANTIC_CACHE_FLUSH_EVERY = 32
+_intent_embeddings = None  # buffer prealokasi, hanya len(_intent_labels) baris pertama terisi
+_intent_labels = []
+_intent_unsaved = 0
+_intent_cache_loaded = False
+_intent_cache_lock = threading.Lock()
+_intent_save_lock = threading.Lock()
+
+# Thread pool untuk generate SQL secara spekulatif selagi intent diklasifikasi.
+# Satu slot per thread gunicorn supaya request bersamaan tidak saling mengantre
+_speculative_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv("GUNICORN_THREADS", 16)),
+    thread_name_prefix="speculative",
+)
+
+# Cache schema database di disk, di-refresh setelah TTL (detik)
+SCHEMA_CACHE_DIR = ".schema_cache"
+SCHEMA_CACHE_TTL = 3600
+
+# Salinan schema di memori per fingerprint: (waktu dimuat, schema_data), LRU
+# supaya /connect ke banyak database berbeda tidak menumpuk tanpa batas
+SCHEMA_MEMO_MAXSIZE = 8
+_schema_memo = OrderedDict()
+
+# Markdown code fence di sekitar SQL (```sql ... ```)
+_SQL_FENCE = re.compile(r"```(?:sql)?", re.IGNORECASE)
+
+# Statement SELECT di mana pun dalam output LLM, sampai ";" atau akhir teks
+_SELECT_STATEMENT = re.compile(r"(SELECT\b.*?)(?:;|\Z)", re.IGNORECASE | re.DOTALL)
+
+# Markdown code fence di sekitar JSON (```json ... ```)
+_JSON_FENCE = re.compile(r"```(?:json)?", re.IGNORECASE)
+_JSON_OBJECT = re.compile(r"\{.*\}", re.DOTALL)
+
+# Kata kunci yang jelas menandai intent. Jika hanya salah satu yang cocok, intent
+# langsung dipakai tanpa LLM; jika keduanya / tidak ada, tetap tanya LLM
+_SCHEMA_KEYWORDS = re.compile(
+    r"\b(tabel|kolom|schema|skema|struktur|relasi|foreign keys?|primary keys?)\b",
+    re.IGNORECASE,
+)
+_QUERY_KEYWORDS = re.compile(
+    r"\b(tampilkan|cari|berapa|hitung|top|limit|where|select)\b",
+    re.IGNORECASE,
+)
+
+# Kata struktur bahasa Inggris muncul di pertanyaan data maupun schema ("sum of the
+# price column" vs "show me the columns"), jadi hanya memaksa LLM yang memutuskan
+_STRUCTURE_WORDS = re.compile(
+    r"\b(tables?|columns?|fields?|structure|relations?|relationships?|keys?"
+    r"|index(?:es)?|indices|constraints?)\b",
+    re.IGNORECASE,
+)
+
+# Whitespace berulang, dirapikan saat normalisasi pertanyaan
+_WHITESPACE = re.compile(r"\s+")
+
 
 def show_spinner(message: str):
     """Tampilkan loading message"""
@@ -16,35 +126,119 @@ def load_environment():
     load_dotenv()
 
 
+def get_http_client():
+    """Return shared httpx client dengan connection pool ke LLM endpoint"""
+    global _http_client
+
+    if _http_client is None:
+        _http_client = httpx.Client(
+            limits=httpx.Limits(
+                max_keepalive_connections=32,
+                max_connections=64,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(60.0, connect=10.0),
+        )
+        atexit.register(_http_client.close)
+
+    return _http_client
+
+
 def setup_openai_client():
     """Setup dan return OpenAI client"""
     try:
-        base_url = os.getenv("LLM_BASE_URL")
-        api_key = os.getenv("LLM_API_KEY")
-
-        if not base_url or not api_key:
+        if not LLM_BASE_URL or not LLM_API_KEY:
             raise ValueError("LLM_BASE_URL dan LLM_API_KEY harus diset di .env file")
 
-        return OpenAI(base_url=base_url, api_key=api_key)
+        return OpenAI(
+            base_url=LLM_BASE_URL,
+            api_key=LLM_API_KEY,
+            http_client=get_http_client(),
+        )
     except Exception as e:
         raise RuntimeError(f"Gagal setup OpenAI client: {str(e)}")
 
 
+def _ping_llm_endpoint(client):
+    """Request ringan ke LLM endpoint untuk membuka / menjaga koneksi"""
+    try:
+        # with_options memakai http client yang sama, jadi koneksinya ikut di pool
+        client.with_options(timeout=HTTP_PING_TIMEOUT, max_retries=0).models.list()
+    except Exception:
+        # Sebagian endpoint tidak menyediakan /models, tapi koneksi TLS tetap terbuka
+        pass
+
+
+def prewarm_openai_client(client, connections: int = 4):
+    """
+    Buka beberapa koneksi ke LLM endpoint sebelum request pertama datang
+
+    Args:
+        client: OpenAI client instance
+        connections: Jumlah koneksi yang dibuka secara paralel
+    """
+    # Ping bersamaan memaksa pool membuka koneksi terpisah untuk masing-masing
+    with ThreadPoolExecutor(max_workers=connections) as pool:
+        for _ in range(connections):
+            pool.submit(_ping_llm_endpoint, client)
+
+
+def schedule_keepalive(
+    client, interval: float = HTTP_KEEPALIVE_EXPIRY / 2, connections: int = 4
+):
+    """
+    Ping LLM endpoint secara berkala supaya koneksi di pool tidak expired
+
+    Args:
+        client: OpenAI client instance
+        interval: Jeda antar ping (detik)
+        connections: Jumlah koneksi yang dijaga, samakan dengan prewarm_openai_client
+
+    Returns:
+        threading.Timer untuk ping berikutnya
+    """
+
+    def tick():
+        # Satu ping hanya menyegarkan satu koneksi, jadi semua koneksi di-ping bersamaan
+        prewarm_openai_client(client, connections)
+        schedule_keepalive(client, interval, connections)
+
+    timer = threading.Timer(interval, tick)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+def create_db_engine(database_url: str):
+    """
+    Buat SQLAlchemy engine dengan connection pool yang di-tuning untuk web request
+
+    Args:
+        database_url: URL koneksi database
+
+    Returns:
+        SQLAlchemy engine instance
+    """
+    return create_engine(
+        database_url,
+        pool_size=20,  # Default 5 terlalu kecil untuk request yang berjalan bersamaan
+        max_overflow=40,
+        pool_pre_ping=True,  # Buang koneksi mati (mis. "MySQL server has gone away")
+        pool_recycle=1800,  # Tutup koneksi sebelum kena wait_timeout server
+    )
+
+
 def setup_database():
     """Setup database engine dan inspector"""
     try:
-        database_url = os.getenv("DATABASE_URL")
-
-        if not database_url:
+        if not DATABASE_URL:
             raise ValueError("DATABASE_URL harus diset di .env file")
 
-        engine = create_engine(database_url)
+        # inspect() langsung membuka koneksi, jadi URL / kredensial yang salah
+        # sudah gagal di sini tanpa perlu query "SELECT 1" terpisah
+        engine = create_db_engine(DATABASE_URL)
         inspector = inspect(engine)
 
-        # Test connection
-        with engine.connect() as conn:
-            conn.execute(text("SELECT 1"))
-
         return engine, inspector
     except Exception as e:
         raise RuntimeError(f"Gagal koneksi ke database: {str(e)}")
@@ -60,8 +254,120 @@ def clean_sql(generated_text: str) -> str:
     Returns:
         SQL query yang sudah dibersihkan
     """
-    cleaned = re.sub(r"```sql|```", "", generated_text, flags=re.IGNORECASE).strip()
-    return cleaned
+    if "```" not in generated_text:
+        return generated_text.strip()
+
+    return _SQL_FENCE.sub("", generated_text).strip()
+
+
+@lru_cache(maxsize=1024)
+def limit_sql(sql_query: str, dialect: str = None, max_rows: int = MAX_ROWS) -> str:
+    """
+    Tambahkan LIMIT ke query SELECT yang belum dibatasi
+
+    Args:
+        sql_query: SQL query yang sudah dibersihkan
+        dialect: Nama dialect SQLAlchemy (engine.dialect.name)
+        max_rows: Jumlah baris maksimum
+
+    Returns:
+        SQL query dengan LIMIT (atau padanannya di dialect tersebut)
+    """
+    read = _sqlglot_dialect(dialect)
+
+    # Query yang tidak bisa di-parse dibiarkan, validate_select yang menolaknya
+    try:
+        statements = [s for s in sqlglot.parse(sql_query, read=read) if s is not None]
+    except sqlglot.errors.SqlglotError:
+        return sql_query
+
+    if len(statements) != 1:
+        return sql_query
+
+    query = statements[0]
+    if not isinstance(query, (exp.Select, exp.Union, exp.Intersect, exp.Except)):
+        return sql_query
+
+    # LIMIT / FETCH FIRST / TOP yang sudah ada dipertahankan apa adanya
+    if query.args.get("limit") or query.args.get("fetch"):
+        return sql_query
+
+    # Lewat AST (bukan tambah teks) supaya tidak jatuh ke dalam komentar "--",
+    # dan di query luar (bukan subquery wrapper) supaya kolom bernama sama tetap valid
+    return query.limit(max_rows).sql(dialect=read)
+
+
+def normalize_question(question: str) -> str:
+    """Normalisasi pertanyaan (lowercase, spasi dirapikan) untuk cache key"""
+    return _WHITESPACE.sub(" ", question.strip().lower())
+
+
+@lru_cache(maxsize=8)
+def schema_fingerprint(schema_text: str) -> str:
+    """SHA1 dari schema text, dihitung sekali per schema"""
+    return hashlib.sha1(schema_text.encode()).hexdigest()
+
+
+def _prompt_cache_key(kind: str, schema_text: str = "") -> str:
+    """Key prompt_cache_key: request dengan prefix prompt yang sama dirutekan ke backend yang sama"""
+    if not schema_text:
+        return f"sqlagent-v1-{kind}"
+    return f"sqlagent-v1-{kind}-{schema_fingerprint(schema_text)[:16]}"
+
+
+def _extra_body(kind: str, schema_text: str = ""):
+    """Field tambahan khusus OpenAI untuk request LLM, None jika tidak ada yang diaktifkan"""
+    extra = {}
+    if LLM_PROMPT_CACHE_KEY:
+        extra["prompt_cache_key"] = _prompt_cache_key(kind, schema_text)
+    if LLM_SEED is not None:
+        extra["seed"] = LLM_SEED
+    return extra or None
+
+
+def _cache_key(fn: str, question: str, schema_text: str = "") -> str:
+    """Key exact-match cache: hash dari (fungsi, model, pertanyaan, schema)"""
+    # Huruf besar/kecil hanya boleh diabaikan untuk label intent. SQL memuat nilai
+    # literal dari pertanyaan ('Budi' vs 'budi'), jadi cukup spasi yang dirapikan
+    if fn == "classify_intent":
+        question = normalize_question(question)
+    else:
+        question = _WHITESPACE.sub(" ", question.strip())
+
+    schema_digest = schema_fingerprint(schema_text) if schema_text else ""
+    raw = "|".join([fn, LLM_MODEL_NAME or "", question, schema_digest])
+    return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+
+def cache_lookup(key: str):
+    """Ambil respons LLM dari cache, None jika belum ada"""
+    with _response_cache_lock:
+        value = _response_cache.get(key)
+        if value is not None:
+            _response_cache.move_to_end(key)
+        return value
+
+
+def cache_update(key: str, value: str):
+    """Simpan respons LLM ke cache, entry terlama dibuang jika penuh"""
+    with _response_cache_lock:
+        _response_cache[key] = value
+        _response_cache.move_to_end(key)
+        if len(_response_cache) > RESPONSE_CACHE_MAXSIZE:
+            _response_cache.popitem(last=False)
+
+
+def clear_response_cache():
+    """Kosongkan cache respons LLM, dipanggil saat schema dimuat ulang"""
+    with _response_cache_lock:
+        _response_cache.clear()
+
+
+def _cacheable_sql(sql: str, dialect: str = None) -> bool:
+    """SQL hanya di-cache jika bukan sentinel error dan lolos validate_select"""
+    if sql.startswith("SELECT 'Error"):
+        return False
+    return validate_select(sql, dialect)[0]
 
 
 def classify_intent(client, question: str) -> str:
@@ -75,64 +381,271 @@ def classify_intent(client, question: str) -> str:
     Returns:
         Intent yang terdeteksi ('schema_info' atau 'query')
     """
-    try:
-        # Structured prompt with role, persona, CoT, and few-shot examples
-        system_prompt = """You are an expert SQL Assistant with deep understanding of database queries and schema information.
+    # Pertanyaan yang sama (setelah normalisasi) tidak perlu ke LLM lagi
+    key = _cache_key("classify_intent", question)
+    intent = cache_lookup(key)
+    if intent is not None:
+        return intent
 
-Your task: Classify user questions into two categories:
-1. "query" - User wants to retrieve data from database
-2. "schema_info" - User wants information about database structure
+    # Kata kunci yang jelas tidak perlu ke LLM sama sekali
+    intent = keyword_intent(question)
+    if intent is not None:
+        cache_update(key, intent)
+        return intent
 
-Think step-by-step:
-- Analyze the question intent
-- Identify keywords related to data retrieval vs. structure inquiry
-- Output ONLY the classification label"""
+    # Pertanyaan yang maknanya mirip memakai label tetangga terdekat
+    embedding = _embed_question(client, question) if EMBEDDING_MODEL_NAME else None
+    if embedding is not None:
+        intent = _semantic_intent_lookup(embedding)
 
-        user_prompt = f"""Classify the following question into either "query" or "schema_info".
+    if intent is None:
+        intent = _classify_intent(client, question)
+        if embedding is not None:
+            _semantic_intent_add(embedding, intent)
 
-Examples for reference:
+    cache_update(key, intent)
+    return intent
 
-Example 1:
-Question: "Ada apa saja tabel di database?"
-Analysis: User is asking about database structure (tables)
-Classification: schema_info
 
-Example 2:
-Question: "Tampilkan 10 users pertama"
-Analysis: User wants to retrieve data (users)
-Classification: query
+def keyword_intent(question: str):
+    """
+    Klasifikasi intent murah berbasis kata kunci
 
-Example 3:
-Question: "Berapa jumlah kolom di tabel products?"
-Analysis: User is asking about table structure (columns)
-Classification: schema_info
+    Args:
+        question: Pertanyaan dari user
 
-Example 4:
-Question: "Cari semua orders dengan total > 1000000"
-Analysis: User wants to retrieve specific data (orders with condition)
-Classification: query
+    Returns:
+        'schema_info' atau 'query' jika hanya satu jenis kata kunci yang cocok, None jika ambigu
+    """
+    is_schema = _SCHEMA_KEYWORDS.search(question) is not None
+    is_query = _QUERY_KEYWORDS.search(question) is not None
+
+    if is_schema == is_query:
+        return None
+    if is_schema:
+        return "schema_info"
 
-Now classify this question:
-Question: "{question}"
+    # "where is the email column stored" bukan permintaan data walau ada "where"
+    if _STRUCTURE_WORDS.search(question):
+        return None
+    return "query"
 
-Output format: Return ONLY one word - either "query" or "schema_info"
-If unsure, default to "query"
 
-Classification:"""
+def _embed_question(client, question: str):
+    """Embedding ternormalisasi (L2) dari pertanyaan, None jika gagal"""
+    try:
+        response = client.embeddings.create(
+            model=EMBEDDING_MODEL_NAME, input=normalize_question(question)
+        )
+        vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+    except Exception as e:
+        print(f"⚠️ Embedding error: {e}")
+        return None
+
+
+def _semantic_cache_path() -> str:
+    """Lokasi file semantic cache, dipisah per embedding model"""
+    digest = hashlib.sha1(EMBEDDING_MODEL_NAME.encode()).hexdigest()[:16]
+    return os.path.join(SEMANTIC_CACHE_DIR, f"{digest}.npz")
 
+
+def _load_semantic_cache():
+    """Muat embedding + label dari disk sekali per proses (panggil dengan lock)"""
+    global _intent_embeddings, _intent_labels, _intent_cache_loaded
+
+    _intent_cache_loaded = True
+    try:
+        with np.load(_semantic_cache_path(), allow_pickle=False) as data:
+            embeddings = data["embeddings"]
+            labels = data["labels"].tolist()
+    except (OSError, KeyError, ValueError):
+        return
+
+    count = min(len(labels), len(embeddings))
+    _intent_embeddings = np.empty(
+        (max(count * 2, 64), embeddings.shape[1]), dtype=np.float32
+    )
+    _intent_embeddings[:count] = embeddings[:count]
+    _intent_labels = labels[:count]
+
+
+def _semantic_intent_lookup(embedding):
+    """Label dari pertanyaan tersimpan paling mirip, None jika di bawah threshold"""
+    with _intent_cache_lock:
+        if not _intent_cache_loaded:
+            _load_semantic_cache()
+        if _intent_embeddings is None or len(_intent_labels) == 0:
+            return None
+
+        # Embedding sudah ternormalisasi, jadi dot product = cosine similarity
+        similarities = _intent_embeddings[: len(_intent_labels)] @ embedding
+        best = int(similarities.argmax())
+        if similarities[best] >= SEMANTIC_CACHE_THRESHOLD:
+            return _intent_labels[best]
+        return None
+
+
+def _semantic_intent_add(embedding, intent: str):
+    """Tambahkan hasil klasifikasi ke semantic cache, simpan ke disk per beberapa entri"""
+    global _intent_embeddings, _intent_unsaved
+
+    with _intent_cache_lock:
+        if not _intent_cache_loaded:
+            _load_semantic_cache()
+        count = len(_intent_labels)
+        if count >= SEMANTIC_CACHE_MAXSIZE:
+            return
+        if _intent_embeddings is None or _intent_embeddings.shape[1] != embedding.size:
+            _intent_embeddings = np.empty((64, embedding.size), dtype=np.float32)
+            _intent_labels.clear()
+            _intent_unsaved = count = 0
+        elif count == len(_intent_embeddings):
+            # Kapasitas digandakan supaya append tidak menyalin seluruh array tiap kali
+            grown = np.empty(
+                (min(count * 2, SEMANTIC_CACHE_MAXSIZE), embedding.size),
+                dtype=np.float32,
+            )
+            grown[:count] = _intent_embeddings
+            _intent_embeddings = grown
+        _intent_embeddings[count] = embedding
+        _intent_labels.append(intent)
+        _intent_unsaved += 1
+        flush = _intent_unsaved >= SEMANTIC_CACHE_FLUSH_EVERY
+
+    if flush:
+        _save_semantic_cache()
+
+
+def _save_semantic_cache():
+    """Gabungkan entri baru proses ini dengan file di disk lalu tulis ulang secara atomik"""
+    global _intent_unsaved
+
+    with _intent_cache_lock:
+        if _intent_unsaved == 0:
+            return
+        count = len(_intent_labels)
+        new_embeddings = _intent_embeddings[count - _intent_unsaved : count].copy()
+        new_labels = _intent_labels[count - _intent_unsaved :]
+        _intent_unsaved = 0
+
+    # Tulis di luar lock utama; isi file dibaca ulang supaya entri dari worker
+    # gunicorn lain tidak tertimpa
+    with _intent_save_lock:
+        path = _semantic_cache_path()
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                embeddings = data["embeddings"]
+                labels = data["labels"].tolist()
+            if embeddings.shape[1] != new_embeddings.shape[1]:
+                raise ValueError("dimensi embedding berbeda")
+        except (OSError, KeyError, ValueError):
+            embeddings, labels = new_embeddings[:0], []
+
+        embeddings = np.vstack([embeddings, new_embeddings])[:SEMANTIC_CACHE_MAXSIZE]
+        labels = (labels + new_labels)[:SEMANTIC_CACHE_MAXSIZE]
+
+        try:
+            os.makedirs(SEMANTIC_CACHE_DIR, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+            np.savez(tmp_path, embeddings=embeddings, labels=np.array(labels))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️ Gagal menyimpan semantic cache: {e}")
+
+
+atexit.register(_save_semantic_cache)
+
+
+# Rubrik klasifikasi intent, statis dan cukup panjang (>= 1024 token) supaya prompt
+# caching provider aktif; hanya pertanyaan user di akhir yang berubah
+_CLASSIFY_RUBRIC = """You are the intent router of a text-to-SQL assistant. Every user message is a question about one relational database (MySQL, MariaDB, PostgreSQL or SQLite). Your only job is to decide which pipeline answers it. You never answer the question yourself.
+
+Categories:
+
+1. "query" - the user wants DATA stored in the database.
+   The answer is produced by running a SELECT statement and showing the resulting rows.
+   Typical signals:
+   - asks to show, list, find, search, filter or display records ("tampilkan", "cari", "lihat data", "show", "list all", "find")
+   - asks for numbers computed from rows: counts, totals, sums, averages, minimum, maximum ("berapa", "hitung", "jumlah", "total", "rata-rata", "how many", "average")
+   - ranking or ordering of records ("top 10", "terbesar", "terbaru", "paling banyak", "latest", "highest")
+   - conditions on values: dates, names, statuses, ranges, text patterns ("yang dibuat bulan ini", "dengan email gmail", "where price > 100")
+   - comparisons or breakdowns over data ("per bulan", "per kategori", "group by", "dibandingkan tahun lalu")
+   - mentions a table only as the SOURCE of records ("tampilkan isi tabel users", "data di tabel orders")
+
+2. "schema_info" - the user wants to know the STRUCTURE of the database itself.
+   The answer is produced from the schema description, no query is executed.
+   Typical signals:
+   - which tables exist, how many tables there are, what a table is for ("ada tabel apa saja", "what tables exist")
+   - which columns a table has, their data types, nullability or defaults ("kolom apa saja di tabel users", "what type is created_at")
+   - primary keys, foreign keys, indexes, unique constraints ("primary key tabel orders apa", "is email unique")
+   - relationships between tables and how to join them ("bagaimana relasi users dan orders", "how are products linked to orders")
+   - general overview or documentation of the database design ("jelaskan struktur database", "describe the schema")
+
+Decision rules:
+- Decide by what the answer must contain: rows or values computed from rows means "query"; names of tables, columns, types, keys or relationships means "schema_info".
+- Counting ROWS is "query" ("berapa jumlah user" asks how many users are stored). Counting TABLES or COLUMNS is "schema_info" ("berapa jumlah tabel" asks about structure).
+- A question that names a table or column is not automatically "schema_info". "Tampilkan email semua user" wants data, so it is "query".
+- A question that uses a data verb is not automatically "query". "Tampilkan daftar tabel" lists structure, so it is "schema_info".
+- Questions about whether a value exists in the data ("apakah ada user bernama Budi") are "query". Questions about whether a column exists ("apakah ada kolom phone di users") are "schema_info".
+- Requests to write, explain or fix SQL that reads data are "query".
+- Greetings, vague or incomplete messages and anything that fits neither category default to "query"; the SQL generator handles unclear questions.
+- If a message asks for both structure and data, choose "query".
+
+Language notes:
+- Users write in Indonesian, English, or a mix of both, often informally and without punctuation.
+- Indonesian data verbs: tampilkan, tunjukkan, lihat, cari, carikan, ambil, hitung, berapa, jumlah, urutkan, filter, daftar.
+- Indonesian structure words: tabel, kolom, struktur, skema, relasi, hubungan, tipe data, kunci utama, kunci asing, indeks.
+- Table and column names may appear in snake_case, English or Indonesian (users, pelanggan, order_items, tanggal_dibuat); they do not change the category on their own.
+- Ignore typos, casing and extra whitespace.
+
+Examples:
+Question: "Tampilkan 10 users pertama" -> query
+Question: "Berapa total users dengan email gmail?" -> query
+Question: "Tampilkan nama dan total orders per user, urutkan dari terbesar" -> query
+Question: "produk apa yang paling laku bulan ini" -> query
+Question: "show me the latest 5 orders" -> query
+Question: "rata-rata harga produk per kategori" -> query
+Question: "apakah ada pelanggan dari Bandung?" -> query
+Question: "tampilkan isi tabel categories" -> query
+Question: "Ada apa saja tabel di database?" -> schema_info
+Question: "Apa saja kolom di tabel users?" -> schema_info
+Question: "Bagaimana relasi antar tabel?" -> schema_info
+Question: "berapa jumlah tabel di database ini" -> schema_info
+Question: "primary key tabel orders apa?" -> schema_info
+Question: "what data type is the created_at column" -> schema_info
+Question: "apakah ada kolom phone di tabel customers" -> schema_info
+Question: "list all customers who signed up in 2024" -> query
+Question: "hitung jumlah transaksi per hari" -> query
+Question: "jelaskan struktur database ini" -> schema_info
+Question: "tabel mana yang menyimpan data pembayaran?" -> schema_info
+Question: "how do I join orders with products" -> schema_info"""
+
+
+_CLASSIFY_SYSTEM_PROMPT = f"""{_CLASSIFY_RUBRIC}
+
+Respond with exactly one word: 'query' or 'schema_info'."""
+
+
+def _classify_intent(client, question: str) -> str:
+    """Klasifikasi intent via LLM (tanpa cache)"""
+    try:
         response = client.chat.completions.create(
-            model=os.getenv("LLM_MODEL_NAME"),
+            model=LLM_MODEL_NAME,
             messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
+                {"role": "system", "content": _CLASSIFY_SYSTEM_PROMPT},
+                {"role": "user", "content": question},
             ],
-            temperature=0.1,  # Lower temperature for consistent classification
-            max_tokens=50,  # We only need one word
+            extra_body=_extra_body("classify"),
+            temperature=0,  # Deterministic classification
+            max_tokens=4,  # "schema_info" is at most a few tokens
         )
 
         # save for gemini
         # result = response.choices[0].message
-        result = response.choices[0].message.content
+        result = (response.choices[0].message.content or "").strip().strip("'\"")
+        result = result.lower()
 
         # Fallback: ensure valid output
         if result not in ["query", "schema_info"]:
@@ -158,7 +671,17 @@ def get_database_schema(inspector):
     table_names = inspector.get_table_names()
     result_data["total_tables"] = len(table_names)
 
+    # Satu query per jenis metadata untuk semua tabel sekaligus. Ini jalur batch
+    # yang sama dengan MetaData.reflect(), tanpa constraint / comment tambahan
+    # yang tidak dipakai di prompt
+    all_columns = inspector.get_multi_columns()
+    all_primary_keys = inspector.get_multi_pk_constraint()
+    all_foreign_keys = inspector.get_multi_foreign_keys()
+    all_indexes = inspector.get_multi_indexes()
+
     for table_name in table_names:
+        # Key hasil get_multi_*: (schema, table), schema None untuk default schema
+        key = (None, table_name)
         table_data = {
             "columns": [],
             "primary_keys": [],
@@ -167,7 +690,7 @@ def get_database_schema(inspector):
         }
 
         # Columns
-        for col in inspector.get_columns(table_name):
+        for col in all_columns.get(key, []):
             table_data["columns"].append(
                 {
                     "name": col["name"],
@@ -178,9 +701,9 @@ def get_database_schema(inspector):
             )
 
         # Primary keys
-        table_data["primary_keys"] = inspector.get_pk_constraint(table_name)[
-            "constrained_columns"
-        ]
+        table_data["primary_keys"] = all_primary_keys.get(key, {}).get(
+            "constrained_columns", []
+        )
 
         # Foreign keys
         table_data["foreign_keys"] = [
@@ -189,7 +712,7 @@ def get_database_schema(inspector):
                 "referred_table": fk["referred_table"],
                 "referred_columns": fk["referred_columns"],
             }
-            for fk in inspector.get_foreign_keys(table_name)
+            for fk in all_foreign_keys.get(key, [])
         ]
 
         # Indexes
@@ -199,7 +722,7 @@ def get_database_schema(inspector):
                 "columns": idx["column_names"],
                 "unique": idx["unique"],
             }
-            for idx in inspector.get_indexes(table_name)
+            for idx in all_indexes.get(key, [])
         ]
 
         result_data["tables"][table_name] = table_data
@@ -207,21 +730,167 @@ def get_database_schema(inspector):
     return result_data
 
 
-def generate_sql_query(client, schema_data, question: str) -> str:
+def load_database_schema(engine, inspector, refresh: bool = False):
+    """
+    Ambil schema database dari cache file, introspeksi ulang jika belum ada / expired
+
+    Args:
+        engine: SQLAlchemy engine instance
+        inspector: SQLAlchemy inspector instance
+        refresh: Abaikan cache dan introspeksi ulang database
+
+    Returns:
+        Dictionary berisi informasi schema database. Objek yang sama dibagi ke
+        semua pemanggil (dan di-memo), jadi perlakukan sebagai read-only
+    """
+    # Fingerprint dari URL (tanpa password) dan daftar tabel yang murah diambil
+    fingerprint = hashlib.sha1(
+        (str(engine.url) + str(inspector.get_table_names())).encode()
+    ).hexdigest()
+    cache_path = os.path.join(SCHEMA_CACHE_DIR, f"{fingerprint}.json")
+
+    if not refresh:
+        # Reconnect ke database yang sama tidak perlu baca file / introspeksi lagi
+        memo = _schema_memo.get(fingerprint)
+        if memo and time.time() - memo[0] < SCHEMA_CACHE_TTL:
+            _schema_memo.move_to_end(fingerprint)
+            return memo[1]
+
+        if os.path.exists(cache_path):
+            loaded_at = os.path.getmtime(cache_path)
+            if time.time() - loaded_at < SCHEMA_CACHE_TTL:
+                try:
+                    with open(cache_path, encoding="utf-8") as f:
+                        schema_data = json.load(f)
+                    _schema_memo_update(fingerprint, loaded_at, schema_data)
+                    return schema_data
+                except (OSError, ValueError):
+                    pass  # Cache rusak, introspeksi ulang
+
+    schema_data = get_database_schema(inspector)
+    _schema_memo_update(fingerprint, time.time(), schema_data)
+
+    # Tulis atomik supaya proses lain tidak membaca file setengah jadi
+    try:
+        os.makedirs(SCHEMA_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(schema_data, f, default=str)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"⚠️  Gagal menyimpan cache schema: {str(e)}")
+
+    return schema_data
+
+
+def _schema_memo_update(fingerprint: str, loaded_at: float, schema_data):
+    """Simpan schema ke memo, buang entri paling lama tidak dipakai jika penuh"""
+    _schema_memo[fingerprint] = (loaded_at, schema_data)
+    _schema_memo.move_to_end(fingerprint)
+    while len(_schema_memo) > SCHEMA_MEMO_MAXSIZE:
+        _schema_memo.popitem(last=False)
+
+
+def compact_schema(schema_data) -> str:
+    """
+    Ringkas schema database menjadi satu baris per tabel untuk prompt LLM
+
+    Format: users(id INTEGER PK, email VARCHAR(255) NOT NULL UNIQUE, name VARCHAR INDEX, ...)
+    Default value dan nama index dibuang; kolom yang ter-index tetap ditandai supaya
+    pertanyaan schema_info tentang index bisa dijawab
+
+    Args:
+        schema_data: Dictionary schema database
+
+    Returns:
+        String schema ringkas yang siap disisipkan ke prompt
+    """
+    lines = []
+
+    for table_name, table in schema_data["tables"].items():
+        primary_keys = set(table["primary_keys"])
+        constraints = []
+
+        # Foreign key satu kolom ditulis di kolomnya, composite di akhir
+        foreign_keys = {}
+        for fk in table["foreign_keys"]:
+            local, referred = fk["constrained_columns"], fk["referred_columns"]
+            referred_table = fk["referred_table"]
+            if len(local) == 1 and len(referred) == 1:
+                foreign_keys[local[0]] = f"{referred_table}.{referred[0]}"
+            else:
+                local, referred = ", ".join(local), ", ".join(referred)
+                constraints.append(f"FK({local})->{referred_table}({referred})")
+
+        # Index satu kolom ditandai di kolomnya (UNIQUE / INDEX), composite di akhir
+        unique_columns, indexed_columns = set(), set()
+        for idx in table["indexes"]:
+            columns = [c for c in idx["columns"] if c]
+            if not columns:
+                continue
+            if len(columns) == 1:
+                (unique_columns if idx["unique"] else indexed_columns).add(columns[0])
+            else:
+                kind = "UNIQUE" if idx["unique"] else "INDEX"
+                constraints.append(f"{kind}({', '.join(columns)})")
+
+        column_defs = []
+        for col in table["columns"]:
+            parts = [col["name"], str(col["type"])]
+            if col["name"] in primary_keys:
+                parts.append("PK")
+            elif not col["nullable"]:
+                parts.append("NOT NULL")
+            if col["name"] in unique_columns:
+                parts.append("UNIQUE")
+            elif col["name"] in indexed_columns:
+                parts.append("INDEX")
+            if col["name"] in foreign_keys:
+                parts.append(f"FK->{foreign_keys[col['name']]}")
+            column_defs.append(" ".join(parts))
+
+        lines.append(f"{table_name}({', '.join(column_defs + constraints)})")
+
+    return "\n".join(lines)
+
+
+def generate_sql_query(
+    client, schema_text: str, question: str, dialect: str = None
+) -> str:
     """
     Generate SQL query dari pertanyaan user
 
     Args:
         client: OpenAI client instance
-        schema_data: Dictionary schema database
+        schema_text: Schema database yang sudah diserialisasi
         question: Pertanyaan dari user
+        dialect: Nama dialect SQLAlchemy, untuk validasi sebelum SQL di-cache
 
     Returns:
         SQL query yang dihasilkan
     """
-    try:
-        # Structured prompt with role, persona, CoT, few-shot examples, and explicit instructions
-        system_prompt = """You are an expert SQL Query Generator with 10+ years of experience in database design and optimization.
+    key = _cache_key("generate_sql_query", question, schema_text)
+    sql = cache_lookup(key)
+
+    if sql is None:
+        sql = _generate_sql_query(client, schema_text, question)
+        if _cacheable_sql(sql, dialect):
+            cache_update(key, sql)
+
+    return sql
+
+
+@lru_cache(maxsize=32)
+def _render_system_prompt(template: str, schema_text: str) -> str:
+    """System prompt lengkap (bagian statis + schema), dirender sekali per schema"""
+    return f"{template}\n\n<database_schema>\n{schema_text}\n</database_schema>"
+
+
+# Structured prompt with role, persona, CoT, few-shot examples, and explicit instructions
+# Bagian statis + schema di system message, pertanyaan di akhir: prefix prompt
+# sama untuk semua pertanyaan sehingga bisa di-cache provider. Template dirender
+# sekali saat import, schema disisipkan lewat _render_system_prompt
+_SQL_SYSTEM_PROMPT = """You are an expert SQL Query Generator with 10+ years of experience in database design and optimization.
 
 Your role:
 - Generate precise, executable SQL queries based on user questions
@@ -232,13 +901,9 @@ Capabilities:
 - Support for complex JOINs, aggregations, and subqueries
 - Proper use of WHERE, GROUP BY, HAVING, ORDER BY clauses
 - Data type awareness and implicit casting
-- Query optimization for performance"""
+- Query optimization for performance
 
-        user_prompt = f"""Given the database schema below, generate a SQL query to answer the user's question.
-
-<database_schema>
-{schema_data}
-</database_schema>
+Given the database schema at the end of this message, generate a SQL query to answer the user's question.
 
 Think step-by-step (Chain-of-Thought):
 1. Identify which table(s) are needed
@@ -265,11 +930,6 @@ Question: "Tampilkan nama dan total orders per user, urutkan dari terbesar"
 Reasoning: Need JOIN between users and orders, aggregate count, sort descending
 SQL: SELECT u.name, COUNT(o.id) as total_orders FROM users u LEFT JOIN orders o ON u.id = o.user_id GROUP BY u.id, u.name ORDER BY total_orders DESC
 
-Now generate SQL for this question:
-<user_question>
-{question}
-</user_question>
-
 Output format requirements:
 ✓ Return ONLY the SQL query
 ✓ NO explanations, NO markdown blocks (```), NO extra text
@@ -278,89 +938,84 @@ Output format requirements:
 ✓ Ensure query is executable
 
 If the question is unclear or impossible:
-- Return: SELECT 'Error: Unable to generate query - question unclear' as message
+- Return: SELECT 'Error: Unable to generate query - question unclear' as message"""
+
+_SQL_USER_PROMPT = """<user_question>
+{question}
+</user_question>
 
 SQL Query:"""
 
+
+def _generate_sql_query(client, schema_text: str, question: str) -> str:
+    """Generate SQL query via LLM (tanpa cache)"""
+    try:
+        system_prompt = _render_system_prompt(_SQL_SYSTEM_PROMPT, schema_text)
+        user_prompt = _SQL_USER_PROMPT.format(question=question)
+
         response = client.chat.completions.create(
-            model=os.getenv("LLM_MODEL_NAME"),
+            model=LLM_MODEL_NAME,
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt},
             ],
-            temperature=0.2,  # Low temp for consistent SQL generation
+            extra_body=_extra_body("sql", schema_text),
+            temperature=0,  # Deterministic SQL, safe to cache per (question, schema)
             max_tokens=1000,
         )
 
         query = response.choices[0].message.content.strip()
-        print(f"[DEBUG] Raw LLM response: {repr(query[:200])}")  # Print first 200 chars
+        logger.debug("Raw LLM response: %r", query[:200])
 
         # Multiple cleaning attempts
         # 1. Try clean_sql function
         query_cleaned = clean_sql(query)
-        print(f"[DEBUG] After clean_sql: {repr(query_cleaned[:200])}")
-
-        # 2. Try to find SELECT statement anywhere in the text
-        import re
+        logger.debug("After clean_sql: %r", query_cleaned[:200])
 
-        # Pattern to match SELECT queries (case insensitive, multiline)
-        select_pattern = r"(SELECT\s+.*?)(?:;|\Z)"
-        match = re.search(select_pattern, query_cleaned, re.IGNORECASE | re.DOTALL)
+        # 2. Try to find SELECT statement anywhere in the text (DOTALL, multiline)
+        match = _SELECT_STATEMENT.search(query_cleaned)
 
         if match:
             extracted_query = match.group(1).strip()
-            print(f"[DEBUG] Extracted query via regex: {repr(extracted_query[:200])}")
+            logger.debug("Extracted query via regex: %r", extracted_query[:200])
             return extracted_query
 
-        # 3. Line-by-line search for SELECT
-        if not query_cleaned.upper().startswith("SELECT"):
-            print(f"[DEBUG] Query doesn't start with SELECT, trying line-by-line...")
-            lines = query_cleaned.split("\n")
-            for i, line in enumerate(lines):
-                stripped = line.strip()
-                if stripped.upper().startswith("SELECT"):
-                    # Try to get multi-line SELECT if needed
-                    remaining_lines = "\n".join(lines[i:])
-                    select_match = re.search(
-                        select_pattern, remaining_lines, re.IGNORECASE | re.DOTALL
-                    )
-                    if select_match:
-                        result = select_match.group(1).strip()
-                        print(
-                            f"[DEBUG] Found SELECT starting at line {i}: {repr(result[:200])}"
-                        )
-                        return result
-                    else:
-                        print(
-                            f"[DEBUG] Found SELECT at line {i}: {repr(stripped[:200])}"
-                        )
-                        return stripped
-
-            # If no valid SELECT found, return error query
-            print("[DEBUG] No valid SELECT statement found in response")
-            print(f"[DEBUG] Full cleaned response: {repr(query_cleaned)}")
-            return "SELECT 'Error: Invalid query generated' as error_message"
-
-        return query_cleaned
+        # If no valid SELECT found, return error query
+        logger.debug("No valid SELECT statement found in response: %r", query_cleaned)
+        return "SELECT 'Error: Invalid query generated' as error_message"
     except Exception as e:
         raise RuntimeError(f"Gagal generate SQL query: {str(e)}")
 
 
-def generate_schema_info(client, schema_data, question: str) -> str:
+def generate_schema_info(client, schema_text: str, question: str) -> str:
     """
     Generate informasi schema dari pertanyaan user
 
     Args:
         client: OpenAI client instance
-        schema_data: Dictionary schema database
+        schema_text: Schema database yang sudah diserialisasi
         question: Pertanyaan dari user
 
     Returns:
         Informasi schema yang dihasilkan
     """
-    try:
-        # Structured prompt with role, persona, CoT, few-shot examples
-        system_prompt = """You are a Database Schema Expert and Documentation Specialist with deep knowledge of database design patterns.
+    key = _cache_key("generate_schema_info", question, schema_text)
+    info = cache_lookup(key)
+
+    if info is None:
+        info = _generate_schema_info(client, schema_text, question)
+
+        # Fallback: If response is empty or too short
+        if not info or len(info) < 10:
+            return "Silakan ajukan pertanyaan spesifik tentang struktur database."
+
+        cache_update(key, info)
+
+    return info
+
+
+# Structured prompt with role, persona, CoT, few-shot examples
+_SCHEMA_INFO_SYSTEM_PROMPT = """You are a Database Schema Expert and Documentation Specialist with deep knowledge of database design patterns.
 
 Your role:
 - Provide clear, concise information about database structure
@@ -372,13 +1027,9 @@ Communication style:
 - Concise and direct
 - Use bullet points for clarity
 - Highlight key information
-- Professional tone"""
+- Professional tone
 
-        user_prompt = f"""Given the database schema below, answer the user's question about the database structure.
-
-<database_schema>
-{schema_data}
-</database_schema>
+Given the database schema at the end of this message, answer the user's question about the database structure.
 
 Think step-by-step (Chain-of-Thought):
 1. Identify what schema information is being requested
@@ -415,11 +1066,6 @@ Relasi antar tabel:
 - orders.user_id → users.id (Many-to-One)
 - orders.product_id → products.id (Many-to-One)
 
-Now answer this question:
-<user_question>
-{question}
-</user_question>
-
 Output format requirements:
 ✓ Provide concise, direct answer
 ✓ Use bullet points or numbered lists for clarity
@@ -428,56 +1074,358 @@ Output format requirements:
 
 If the question is unclear:
 - Provide general overview of database structure
-- List available tables and brief descriptions
+- List available tables and brief descriptions"""
+
+_SCHEMA_INFO_USER_PROMPT = """<user_question>
+{question}
+</user_question>
 
 Response:"""
 
+
+def _generate_schema_info(client, schema_text: str, question: str) -> str:
+    """Generate informasi schema via LLM (tanpa cache)"""
+    try:
+        system_prompt = _render_system_prompt(_SCHEMA_INFO_SYSTEM_PROMPT, schema_text)
+        user_prompt = _SCHEMA_INFO_USER_PROMPT.format(question=question)
+
         response = client.chat.completions.create(
-            model=os.getenv("LLM_MODEL_NAME"),
+            model=LLM_MODEL_NAME,
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt},
             ],
+            extra_body=_extra_body("schema_info", schema_text),
             temperature=0.3,  # Moderate temp for natural language
             max_tokens=500,
         )
 
-        info = response.choices[0].message.content.strip()
+        return (response.choices[0].message.content or "").strip()
+    except Exception as e:
+        raise RuntimeError(f"Gagal generate schema info: {str(e)}")
 
-        # Fallback: If response is empty or too short
-        if not info or len(info) < 10:
-            return f"Database memiliki {schema_data.get('total_tables', 0)} tabel. Silakan ajukan pertanyaan spesifik tentang struktur database."
 
-        return info
+# Structured prompt with role, persona, CoT, few-shot examples, and JSON output contract
+_ANSWER_SYSTEM_PROMPT = """You are an expert SQL Assistant with deep understanding of database queries and schema information.
+
+Your role:
+- Classify the user question as "query" (retrieve data) or "schema_info" (database structure)
+- For "query": generate a precise, executable SQL query (SELECT only)
+- For "schema_info": answer concisely about tables, columns, relationships, and constraints
+- Always respond with a single JSON object and nothing else
+
+Given the database schema at the end of this message, classify the user's question and answer it.
+
+Think step-by-step (Chain-of-Thought):
+1. Decide whether the user wants data (query) or structure information (schema_info)
+2. For query: identify tables, columns, filters, aggregation, sorting, and limits
+3. For schema_info: extract the relevant tables, columns, and relationships
+
+Few-shot examples:
+
+Example 1:
+Question: "Tampilkan 10 users pertama"
+Output: {"intent": "query", "payload": "SELECT * FROM users LIMIT 10"}
+
+Example 2:
+Question: "Berapa total users dengan email gmail?"
+Output: {"intent": "query", "payload": "SELECT COUNT(*) FROM users WHERE email LIKE '%@gmail.com%'"}
+
+Example 3:
+Question: "Ada apa saja tabel di database?"
+Output: {"intent": "schema_info", "payload": "Database memiliki 3 tabel:\\n1. users - Menyimpan informasi pengguna\\n2. products - Menyimpan data produk\\n3. orders - Menyimpan transaksi pesanan"}
+
+Example 4:
+Question: "Bagaimana relasi antar tabel?"
+Output: {"intent": "schema_info", "payload": "Relasi antar tabel:\\n- orders.user_id → users.id (Many-to-One)\\n- orders.product_id → products.id (Many-to-One)"}
+
+Output format requirements:
+- Return ONLY a JSON object: {"intent": "query" | "schema_info", "payload": "..."}
+- For "query", payload is ONLY the SQL query starting with SELECT, NO markdown blocks
+- For "schema_info", payload is a concise answer using bullet points, under 200 words
+- If unsure about the intent, default to "query\""""
+
+_ANSWER_USER_PROMPT = """<user_question>
+{question}
+</user_question>
+
+JSON:"""
+
+
+def classify_and_answer(client, schema_text: str, question: str, dialect: str = None):
+    """
+    Klasifikasi intent sekaligus generate jawaban dalam satu panggilan LLM
+
+    Args:
+        client: OpenAI client instance
+        schema_text: Schema database yang sudah diserialisasi
+        question: Pertanyaan dari user
+        dialect: Nama dialect SQLAlchemy, untuk validasi sebelum SQL di-cache
+
+    Returns:
+        Tuple (intent: 'query' atau 'schema_info', payload: SQL query atau informasi schema)
+    """
+    # Pertanyaan yang pernah dijawab untuk schema yang sama tidak perlu ke LLM lagi
+    sql_key = _cache_key("generate_sql_query", question, schema_text)
+    info_key = _cache_key("generate_schema_info", question, schema_text)
+
+    cached_sql = cache_lookup(sql_key)
+    if cached_sql is not None:
+        return "query", cached_sql
+
+    cached_info = cache_lookup(info_key)
+    if cached_info is not None:
+        return "schema_info", cached_info
+
+    try:
+        system_prompt = _render_system_prompt(_ANSWER_SYSTEM_PROMPT, schema_text)
+        user_prompt = _ANSWER_USER_PROMPT.format(question=question)
+
+        response = client.chat.completions.create(
+            model=LLM_MODEL_NAME,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt},
+            ],
+            extra_body=_extra_body("answer", schema_text),
+            temperature=0,  # Deterministic classification and SQL
+            max_tokens=1000,
+        )
+
+        content = response.choices[0].message.content or ""
+        parsed = _parse_json_object(content)
+
+        if parsed:
+            intent = str(parsed.get("intent", "")).strip().lower()
+            payload = str(parsed.get("payload", "")).strip()
+
+            if intent in ["query", "schema_info"] and payload:
+                if intent == "query":
+                    payload = clean_sql(payload)
+                    if _cacheable_sql(payload, dialect):
+                        cache_update(sql_key, payload)
+                else:
+                    cache_update(info_key, payload)
+                return intent, payload
     except Exception as e:
-        raise RuntimeError(f"Gagal generate schema info: {str(e)}")
+        raise RuntimeError(f"Gagal memproses pertanyaan: {str(e)}")
+
+    # Fallback: output tidak valid, gunakan pipeline dua langkah
+    return _classify_then_answer(client, schema_text, question, dialect)
+
+
+def _classify_then_answer(client, schema_text: str, question: str, dialect: str):
+    """Pipeline dua langkah, SQL di-generate spekulatif bersamaan dengan klasifikasi"""
+    sql_key = _cache_key("generate_sql_query", question, schema_text)
+
+    # Mayoritas pertanyaan adalah query, jadi SQL langsung di-generate tanpa
+    # menunggu intent. Hasilnya baru di-cache setelah intent terbukti 'query'
+    sql_future = None
+    if cache_lookup(sql_key) is None:
+        sql_future = _speculative_pool.submit(
+            _generate_sql_query, client, schema_text, question
+        )
+
+    try:
+        intent = classify_intent(client, question)
+    except Exception:
+        # Jangan tinggalkan panggilan spekulatif yang hasilnya tidak akan dipakai
+        if sql_future is not None:
+            sql_future.cancel()
+        raise
+
+    if intent == "schema_info":
+        if sql_future is not None:
+            sql_future.cancel()  # Hasil spekulatif dibuang
+        return intent, generate_schema_info(client, schema_text, question)
+
+    if sql_future is None:
+        return intent, generate_sql_query(client, schema_text, question, dialect)
+
+    sql = sql_future.result()
+    if _cacheable_sql(sql, dialect):
+        cache_update(sql_key, sql)
+    return intent, sql
+
+
+def answer_question(client, engine, schema_text: str, question: str):
+    """
+    Jawab pertanyaan user: klasifikasi intent, generate jawaban, dan execute SQL
+
+    Args:
+        client: OpenAI client instance
+        engine: SQLAlchemy engine instance
+        schema_text: Schema database yang sudah diserialisasi
+        question: Pertanyaan dari user
+
+    Returns:
+        Dictionary hasil dengan key 'intent' dan 'type', ditambah:
+        - query: 'sql', 'success', lalu 'columns' + 'rows' (iterator tuple) atau 'error'
+        - schema_info: 'info'
+    """
+    intent, payload = classify_and_answer(
+        client, schema_text, question, engine.dialect.name
+    )
+    return _build_answer(engine, intent, payload)
+
 
+def _build_answer(engine, intent: str, payload: str):
+    """Bentuk dictionary hasil dari intent + payload, execute SQL untuk intent 'query'"""
+    if intent == "schema_info":
+        return {"intent": intent, "type": "schema_info", "info": payload}
 
-def execute_select_query(engine, sql_query: str):
+    # Clean, batasi jumlah baris, dan execute query
+    sql_query = limit_sql(clean_sql(payload), engine.dialect.name)
+    success, result = execute_select_query(engine, sql_query)
+
+    response = {
+        "intent": intent,
+        "type": "query",
+        "sql": sql_query,
+        "success": success,
+    }
+
+    if success:
+        response["columns"], response["rows"] = result
+    else:
+        response["error"] = result
+
+    return response
+
+
+def _parse_json_object(content: str):
+    """Parse JSON object dari output LLM, dengan fallback regex untuk teks di sekitarnya"""
+    cleaned = _JSON_FENCE.sub("", content).strip()
+
+    try:
+        parsed = json.loads(cleaned)
+    except ValueError:
+        match = _JSON_OBJECT.search(cleaned)
+        if not match:
+            return None
+        try:
+            parsed = json.loads(match.group(0))
+        except ValueError:
+            return None
+
+    return parsed if isinstance(parsed, dict) else None
+
+
+# Nama dialect SQLAlchemy yang berbeda di sqlglot
+_SQLGLOT_DIALECTS = {"postgresql": "postgres", "mariadb": "mysql", "mssql": "tsql"}
+
+
+def _sqlglot_dialect(dialect: str = None):
+    """Dialect sqlglot untuk dialect SQLAlchemy, None (generic) jika tidak dikenal"""
+    name = _SQLGLOT_DIALECTS.get(dialect, dialect)
+    if not name:
+        return None
+    try:
+        return name if Dialect.get(name) is not None else None
+    except ValueError:
+        return None
+
+
+@lru_cache(maxsize=1024)
+def validate_select(sql_query: str, dialect: str = None):
+    """
+    Validasi SQL dengan sqlglot sebelum dikirim ke database
+
+    Args:
+        sql_query: SQL query yang akan divalidasi
+        dialect: Nama dialect SQLAlchemy (engine.dialect.name)
+
+    Returns:
+        Tuple (valid: bool, error message or None)
     """
-    Execute SELECT query dan return hasilnya
+    try:
+        statements = [
+            statement
+            for statement in sqlglot.parse(sql_query, read=_sqlglot_dialect(dialect))
+            if statement is not None
+        ]
+    except sqlglot.errors.SqlglotError as e:
+        return False, f"Query tidak valid: {str(e)}"
+
+    if len(statements) != 1:
+        return False, "Hanya satu query SELECT yang boleh dieksekusi."
+
+    if not isinstance(
+        statements[0], (exp.Select, exp.Union, exp.Intersect, exp.Except)
+    ):
+        return False, "Hanya query SELECT yang boleh dieksekusi."
+
+    return True, None
+
+
+def execute_select_query(
+    engine, sql_query: str, chunksize: int = 1000, as_dataframe: bool = False
+):
+    """
+    Execute SELECT query dengan server-side cursor, hasil di-stream per baris
 
     Args:
         engine: SQLAlchemy engine instance
         sql_query: SQL query yang akan dieksekusi
+        chunksize: Jumlah baris yang di-fetch dari database per batch
+        as_dataframe: Kumpulkan semua baris ke DataFrame (untuk analisis lanjutan)
 
     Returns:
-        Tuple (success: bool, result: DataFrame or error message)
+        Tuple (success: bool, result: (columns, iterator of row tuple), DataFrame, or error message)
     """
     # Validasi query
     if not sql_query.lower().startswith("select"):
         return False, "Hanya query SELECT yang boleh dieksekusi."
 
+    # Parse lokal dulu, query yang tidak valid tidak perlu round-trip ke database
+    valid, error = validate_select(sql_query, engine.dialect.name)
+    if not valid:
+        return False, error
+
+    if as_dataframe:
+        # Import di sini supaya startup CLI tidak ikut membayar import pandas
+        import pandas as pd
+
+        # pandas membangun kolom langsung dari cursor, tanpa list dict per baris
+        try:
+            with engine.connect() as conn:
+                return True, pd.read_sql_query(text(sql_query), conn)
+        except Exception as e:
+            return False, f"Error: {str(e)}"
+
     try:
-        with engine.connect() as conn:
-            result = conn.execute(text(sql_query))
-            rows = result.fetchall()
-
-            if rows:
-                # Konversi ke DataFrame
-                df = pd.DataFrame(rows, columns=result.keys())
-                return True, df
-            else:
-                return True, "Query berhasil, tapi tidak ada hasil."
+        conn = engine.connect()
+        try:
+            result = conn.execution_options(
+                stream_results=True, yield_per=chunksize
+            ).execute(text(sql_query))
+
+            # Batch pertama diambil di sini: error runtime yang baru muncul saat
+            # FETCH (mis. division by zero di Postgres) tetap dilaporkan sebagai gagal
+            columns = list(result.keys())
+            partitions = result.partitions()
+            first_partition = next(partitions, [])
+        except Exception:
+            conn.close()
+            raise
     except Exception as e:
         return False, f"Error: {str(e)}"
+
+    if not first_partition:
+        result.close()
+        conn.close()
+        return True, (columns, [])
+
+    def iter_rows():
+        # Koneksi tetap terbuka sampai semua baris selesai dibaca. Baris diambil
+        # per batch (fetchmany sebesar chunksize), memori tetap O(chunksize)
+        try:
+            for partition in itertools.chain([first_partition], partitions):
+                # Tuple, bukan dict: kolom bernama sama (u.id, o.id) tidak saling timpa
+                for row in partition:
+                    yield tuple(row)
+        finally:
+            result.close()
+            conn.close()
+
+    return True, (columns, iter_rows())
@@ -1,14 +1,13 @@
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from helpers import (
     load_environment,
     setup_openai_client,
+    prewarm_openai_client,
     setup_database,
-    get_database_schema,
-    classify_intent,
-    generate_sql_query,
-    generate_schema_info,
-    clean_sql,
-    execute_select_query,
+    load_database_schema,
+    compact_schema,
+    answer_question,
     show_spinner,
 )
 
@@ -19,12 +18,16 @@ def main():
     try:
         # Setup environment dan services
         load_environment()
-        client = setup_openai_client()
-        engine, inspector = setup_database()
 
-        # Ambil schema database
+        # Setup LLM dan database tidak saling bergantung, jalankan bersamaan
         show_spinner("Memuat schema database...")
-        schema_data = get_database_schema(inspector)
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            client_future = pool.submit(setup_llm)
+            database_future = pool.submit(setup_database_schema)
+            client = client_future.result()
+            engine, schema_data = database_future.result()
+
+        schema_text = compact_schema(schema_data)
         print(f"\r✅ Schema loaded: {schema_data['total_tables']} tables found\n")
 
         # Main loop
@@ -42,18 +45,16 @@ def main():
                     print("\n👋 Terima kasih telah menggunakan SQL Agent!")
                     break
 
-                # Klasifikasi intent
+                # Klasifikasi intent, generate jawaban, dan execute query
                 show_spinner("Menganalisis pertanyaan...")
-                intent = classify_intent(client, user_input)
-                print(f"\r🔍 Intent terdeteksi: '{intent}'")
-
-                # Handle berdasarkan intent
-                if intent.lower() == "query":
-                    handle_query_intent(client, engine, schema_data, user_input)
-                elif intent.lower() == "schema_info":
-                    handle_schema_info_intent(client, schema_data, user_input)
+                result = answer_question(client, engine, schema_text, user_input)
+                print(f"\r🔍 Intent terdeteksi: '{result['intent']}'")
+
+                # Tampilkan berdasarkan intent
+                if result["type"] == "query":
+                    handle_query_intent(result)
                 else:
-                    print("⚠️ Maaf, jenis pertanyaan tidak dikenali.")
+                    handle_schema_info_intent(result)
 
             except KeyboardInterrupt:
                 print("\n\n👋 Keluar dari SQL Agent. Terima kasih!")
@@ -73,63 +74,65 @@ def main():
         sys.exit(1)
 
 
-def handle_query_intent(client, engine, schema_data, question: str):
+def setup_llm():
+    """Setup OpenAI client dan buka koneksi ke LLM endpoint"""
+    client = setup_openai_client()
+    prewarm_openai_client(client, connections=1)
+    return client
+
+
+def setup_database_schema():
+    """Setup database dan ambil schema-nya"""
+    engine, inspector = setup_database()
+    return engine, load_database_schema(engine, inspector)
+
+
+def handle_query_intent(result):
     """
-    Handle intent 'query' - generate dan execute SQL query
+    Handle intent 'query' - tampilkan SQL query dan hasilnya
 
     Args:
-        client: OpenAI client instance
-        engine: SQLAlchemy engine instance
-        schema_data: Dictionary schema database
-        question: Pertanyaan dari user
+        result: Dictionary hasil answer_question dengan type 'query'
     """
     try:
-        # Generate SQL query
-        show_spinner("Membuat SQL query...")
-        openai_output = generate_sql_query(client, schema_data, question)
-        print(f"\r✅ SQL query berhasil dibuat")
+        print("✅ SQL query berhasil dibuat")
         print("\n📝 Generated Query:")
-        print(f"   {openai_output}\n")
-
-        # Clean dan execute query
-        sql_query = clean_sql(openai_output)
-        show_spinner("Menjalankan query...")
-        success, result = execute_select_query(engine, sql_query)
-
-        if success:
-            print("\r✅ Query berhasil dijalankan")
-            if isinstance(result, str):
-                # Tidak ada hasil
-                print(f"\n💡 {result}")
+        print(f"   {result['sql']}\n")
+
+        if result["success"]:
+            print("✅ Query berhasil dijalankan")
+            columns = result["columns"]
+
+            # Tampilkan baris segera setelah diterima dari database
+            row_count = 0
+            for row in result["rows"]:
+                if row_count == 0:
+                    print("\n📊 Hasil Query:")
+                    print(" | ".join(columns))
+                print(" | ".join(str(value) for value in row))
+                row_count += 1
+
+            if row_count:
+                print(f"\n({row_count} rows)")
             else:
-                # Ada hasil, tampilkan DataFrame
-                print(f"\n📊 Hasil Query ({len(result)} rows):")
-                print(result.to_string(index=False))
+                print("\n💡 Query berhasil, tapi tidak ada hasil.")
         else:
             # Error
-            print(f"\r❌ {result}")
+            print(f"❌ {result['error']}")
     except Exception as e:
         print(f"\n❌ Error saat memproses query: {str(e)}")
 
 
-def handle_schema_info_intent(client, schema_data, question: str):
+def handle_schema_info_intent(result):
     """
     Handle intent 'schema_info' - tampilkan informasi schema
 
     Args:
-        client: OpenAI client instance
-        schema_data: Dictionary schema database
-        question: Pertanyaan dari user
+        result: Dictionary hasil answer_question dengan type 'schema_info'
     """
-    try:
-        # Generate schema info
-        show_spinner("Mengambil informasi schema...")
-        schema_info = generate_schema_info(client, schema_data, question)
-        print("\r✅ Informasi berhasil diperoleh")
-        print(f"\n📚 Informasi Schema:")
-        print(f"{schema_info}")
-    except Exception as e:
-        print(f"\n❌ Error saat mengambil info schema: {str(e)}")
+    print("✅ Informasi berhasil diperoleh")
+    print(f"\n📚 Informasi Schema:")
+    print(f"{result['info']}")
 
 
 if __name__ == "__main__":
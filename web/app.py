@@ -1,20 +1,50 @@
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, NamedTuple
+import orjson
 from dotenv import load_dotenv
 
 load_dotenv()
-from flask import Flask, render_template, request
-from sqlalchemy import create_engine, inspect, text
+from flask import Flask, jsonify, render_template, request, stream_template
+from flask.json.provider import JSONProvider
+from sqlalchemy import inspect
 import helpers
 
+
+class OrjsonProvider(JSONProvider):
+    """JSON provider Flask berbasis orjson (lebih cepat dari json bawaan)"""
+
+    def dumps(self, obj, **kwargs):
+        # default=str untuk tipe dari database seperti Decimal
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS, default=str).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 app.secret_key = os.urandom(24)  # Untuk session management
 
-# Global variables untuk menyimpan client, engine, dan schema
+
+class DatabaseState(NamedTuple):
+    """Koneksi database aktif beserta schema-nya, diganti utuh (tidak pernah diubah)"""
+
+    engine: Any
+    inspector: Any
+    schema_data: dict
+    schema_text: str
+    db_url: str
+
+
+# Global variables untuk menyimpan client dan state database. Request membaca
+# db_state sekali lalu memakai salinan lokalnya, jadi tidak perlu lock untuk membaca
 client = None
-engine = None
-inspector = None
-schema_data = None
-current_db_url = None
+db_state = None
+
+# Lock supaya hanya satu /connect atau /schema/refresh yang mengganti db_state
+db_lock = threading.Lock()
 
 
 def initialize_openai_client():
@@ -23,6 +53,10 @@ def initialize_openai_client():
 
     try:
         client = helpers.setup_openai_client()
+
+        # Buka koneksi ke LLM endpoint sebelum request pertama
+        helpers.prewarm_openai_client(client)
+        helpers.schedule_keepalive(client)
         print(f"✅ OpenAI client berhasil diinisialisasi!")
         return True
     except Exception as e:
@@ -30,31 +64,46 @@ def initialize_openai_client():
         return False
 
 
-def connect_database(database_url=None):
+def connect_database(database_url=None, refresh_schema=False):
     """Connect to database with given URL or from .env"""
-    global engine, inspector, schema_data, current_db_url
+    global db_state
 
     try:
         # Gunakan database_url yang diberikan atau dari .env
         if not database_url:
-            database_url = os.getenv("DATABASE_URL")
+            database_url = helpers.DATABASE_URL
 
         if not database_url:
             raise ValueError("DATABASE_URL tidak ditemukan")
 
-        # Create engine dan inspector
-        engine = create_engine(database_url)
-        inspector = inspect(engine)
+        with db_lock:
+            # Create engine dan inspector, inspect() sekaligus menguji koneksi
+            new_engine = helpers.create_db_engine(database_url)
+            new_inspector = inspect(new_engine)
+
+            # Load database schema
+            new_schema_data = helpers.load_database_schema(
+                new_engine, new_inspector, refresh=refresh_schema
+            )
+            new_schema_text = helpers.compact_schema(new_schema_data)
+
+            # Ganti state dengan satu assignment setelah semuanya berhasil, supaya
+            # request yang berjalan bersamaan tidak melihat state setengah jadi
+            old_state = db_state
+            db_state = DatabaseState(
+                new_engine, new_inspector, new_schema_data, new_schema_text, database_url
+            )
 
-        # Test connection
-        with engine.connect() as conn:
-            conn.execute(text("SELECT 1"))
+            # Refresh berarti schema / data mungkin berubah, jawaban lama dibuang
+            if refresh_schema:
+                helpers.clear_response_cache()
 
-        # Load database schema
-        schema_data = helpers.get_database_schema(inspector)
-        current_db_url = database_url
+        # Tutup pool engine lama; koneksi yang masih dipakai request berjalan
+        # ditutup saat dikembalikan ke pool
+        if old_state is not None:
+            old_state.engine.dispose()
 
-        print(f"✅ Database connected: {schema_data['total_tables']} tables found")
+        print(f"✅ Database connected: {new_schema_data['total_tables']} tables found")
         return True, None
 
     except Exception as e:
@@ -78,17 +127,20 @@ def build_database_url(db_type, host, user, password, db_name):
 @app.route("/", methods=["GET", "POST"])
 def index():
     """Main route - GET untuk tampilan, POST untuk query"""
-    try:
-        # Get default DB URL from .env
-        default_db_url = os.getenv("DATABASE_URL", "")
+    # Baca state database sekali; /connect bersamaan tidak mengubah salinan ini
+    state = db_state
+
+    # Get default DB URL from .env
+    default_db_url = helpers.DATABASE_URL or ""
 
+    try:
         # Handle GET request - tampilkan halaman
         if request.method == "GET":
             return render_template(
                 "index.html",
-                current_db_url=current_db_url or default_db_url,
-                is_connected=schema_data is not None,
-                total_tables=schema_data["total_tables"] if schema_data else 0,
+                current_db_url=state.db_url if state else default_db_url,
+                is_connected=state is not None,
+                total_tables=state.schema_data["total_tables"] if state else 0,
             )
 
         # Handle POST request - process query
@@ -96,11 +148,11 @@ def index():
         print("🔍 Processing new query...")
 
         # Check if database is connected
-        if schema_data is None:
+        if state is None:
             print("❌ Database not connected")
             return render_template(
                 "index.html",
-                current_db_url=current_db_url or default_db_url,
+                current_db_url=default_db_url,
                 is_connected=False,
                 error="Silakan hubungkan ke database terlebih dahulu!",
             )
@@ -113,36 +165,29 @@ def index():
             print("❌ Empty question")
             return render_template(
                 "index.html",
-                current_db_url=current_db_url,
+                current_db_url=state.db_url,
                 is_connected=True,
-                total_tables=schema_data["total_tables"],
+                total_tables=state.schema_data["total_tables"],
                 error="Pertanyaan tidak boleh kosong!",
             )
 
-        # Klasifikasi intent
-        print("🔄 Classifying intent...")
-        intent = helpers.classify_intent(client, question)
+        # Klasifikasi intent, generate jawaban, dan execute query
+        print("🔄 Answering question...")
+        result = helpers.answer_question(
+            client, state.engine, state.schema_text, question
+        )
+        intent = result["intent"]
         print(f"✅ Intent: {intent}")
+        if result["type"] == "query":
+            print(f"📝 SQL: {result['sql']}")
 
-        # Handle berdasarkan intent
-        if intent.lower() == "query":
-            print("🔄 Handling query intent...")
-            result = handle_query_intent(question)
-            print("✅ Query intent handled")
-        elif intent.lower() == "schema_info":
-            print("🔄 Handling schema_info intent...")
-            result = handle_schema_info_intent(question)
-            print("✅ Schema info intent handled")
-        else:
-            print(f"⚠️  Unknown intent: {intent}")
-            result = {"intent": intent, "error": "Jenis pertanyaan tidak dikenali"}
-
+        # Stream halaman supaya baris hasil query dikirim sambil dibaca dari database
         print("✅ Rendering response...")
-        return render_template(
+        return stream_template(
             "index.html",
-            current_db_url=current_db_url,
+            current_db_url=state.db_url,
             is_connected=True,
-            total_tables=schema_data["total_tables"],
+            total_tables=state.schema_data["total_tables"],
             question=question,
             intent=intent,
             result=result,
@@ -155,9 +200,9 @@ def index():
         traceback.print_exc()
         return render_template(
             "index.html",
-            current_db_url=current_db_url or default_db_url,
-            is_connected=schema_data is not None,
-            total_tables=schema_data["total_tables"] if schema_data else 0,
+            current_db_url=state.db_url if state else default_db_url,
+            is_connected=state is not None,
+            total_tables=state.schema_data["total_tables"] if state else 0,
             error=f"Terjadi kesalahan: {str(e)}",
         )
 
@@ -179,12 +224,13 @@ def connect():
         success, error_msg = connect_database(database_url)
 
         if success:
+            state = db_state
             return render_template(
                 "index.html",
-                current_db_url=current_db_url,
+                current_db_url=state.db_url,
                 is_connected=True,
-                total_tables=schema_data["total_tables"],
-                success_message=f"Berhasil terhubung ke database! Ditemukan {schema_data['total_tables']} tabel.",
+                total_tables=state.schema_data["total_tables"],
+                success_message=f"Berhasil terhubung ke database! Ditemukan {state.schema_data['total_tables']} tabel.",
             )
         else:
             return render_template(
@@ -198,73 +244,117 @@ def connect():
         return render_template("index.html", error=f"Terjadi kesalahan: {str(e)}")
 
 
-def handle_query_intent(question: str):
-    """Handle intent 'query' - generate dan execute SQL query"""
+@app.route("/schema/refresh", methods=["POST"])
+def refresh_schema():
+    """Abaikan cache schema dan introspeksi ulang database yang sedang terhubung"""
     try:
-        # Generate SQL query
-        print("🔄 Generating SQL query...")
-        openai_output = helpers.generate_sql_query(client, schema_data, question)
-        print(f"📝 Raw LLM output: {openai_output}")
-
-        # Clean dan execute query
-        sql_query = helpers.clean_sql(openai_output)
-        success, result = helpers.execute_select_query(engine, sql_query)
+        state = db_state
+        if state is None:
+            return render_template(
+                "index.html",
+                is_connected=False,
+                error="Silakan hubungkan ke database terlebih dahulu!",
+            )
 
-        response = {"type": "query", "sql": sql_query, "success": success}
+        success, error_msg = connect_database(state.db_url, refresh_schema=True)
 
         if success:
-            if isinstance(result, str):
-                # Tidak ada hasil
-                response["message"] = result
-                response["data"] = None
-            else:
-                # Ada hasil, convert DataFrame ke HTML table
-                response["data"] = result.to_html(index=False, classes="table")
-                response["row_count"] = len(result)
+            state = db_state
+            return render_template(
+                "index.html",
+                current_db_url=state.db_url,
+                is_connected=True,
+                total_tables=state.schema_data["total_tables"],
+                success_message=f"Schema berhasil diperbarui! Ditemukan {state.schema_data['total_tables']} tabel.",
+            )
         else:
-            # Error
-            response["error"] = result
-
-        return response
+            return render_template(
+                "index.html",
+                current_db_url=state.db_url,
+                is_connected=True,
+                total_tables=state.schema_data["total_tables"],
+                error=error_msg,
+            )
 
     except Exception as e:
-        return {"type": "query", "error": f"Error saat memproses query: {str(e)}"}
+        return render_template("index.html", error=f"Terjadi kesalahan: {str(e)}")
 
 
-def handle_schema_info_intent(question: str):
-    """Handle intent 'schema_info' - tampilkan informasi schema"""
-    try:
-        # Generate schema info
-        schema_info = helpers.generate_schema_info(client, schema_data, question)
-
-        return {"type": "schema_info", "info": schema_info}
+@app.route("/api/ask_batch", methods=["POST"])
+def ask_batch():
+    """Jawab beberapa pertanyaan sekaligus (JSON), satu panggilan LLM untuk semuanya"""
+    state = db_state
+    if state is None:
+        return jsonify({"error": "Silakan hubungkan ke database terlebih dahulu!"}), 400
+
+    # Body JSON selain object (mis. array / string) diperlakukan sama dengan kosong
+    body = request.get_json(silent=True)
+    questions = body.get("questions") if isinstance(body, dict) else None
+
+    if (
+        not isinstance(questions, list)
+        or not questions
+        or not all(isinstance(q, str) and q.strip() for q in questions)
+    ):
+        return jsonify({"error": "questions harus berupa list pertanyaan"}), 400
+
+    if len(questions) > helpers.BATCH_MAX_QUESTIONS:
+        return (
+            jsonify(
+                {
+                    "error": f"Maksimal {helpers.BATCH_MAX_QUESTIONS} pertanyaan per request"
+                }
+            ),
+            400,
+        )
 
+    try:
+        print(f"🔄 Answering batch of {len(questions)} questions...")
+        results = helpers.answer_questions(
+            client, state.engine, state.schema_text, [q.strip() for q in questions]
+        )
+        return jsonify({"results": results})
     except Exception as e:
-        return {
-            "type": "schema_info",
-            "error": f"Error saat mengambil info schema: {str(e)}",
-        }
+        print(f"❌ Error: {str(e)}")
+        return jsonify({"error": f"Terjadi kesalahan: {str(e)}"}), 500
 
 
-if __name__ == "__main__":
-    # Initialize OpenAI client
-    if initialize_openai_client():
-        print("\n🚀 Starting Flask server...")
-        print(
-            "💡 Anda bisa menggunakan database default dari .env atau input manual di web interface"
-        )
+def initialize_app():
+    """Initialize OpenAI client dan koneksi ke database default dari .env"""
+    default_db = helpers.DATABASE_URL
+
+    # OpenAI client (+ pre-warm) dan koneksi database berjalan bersamaan
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        client_future = pool.submit(initialize_openai_client)
 
         # Try to connect to default database from .env (optional)
-        default_db = os.getenv("DATABASE_URL")
+        database_future = None
         if default_db:
             print("\n🔌 Mencoba koneksi ke database default...")
-            success, error = connect_database(default_db)
-            if not success:
-                print(f"⚠️  Gagal koneksi otomatis: {error}")
-                print(
-                    "💡 Silakan input database connection secara manual di web interface"
-                )
+            database_future = pool.submit(connect_database, default_db)
+
+        if not client_future.result():
+            return False
 
+    print(
+        "💡 Anda bisa menggunakan database default dari .env atau input manual di web interface"
+    )
+
+    if database_future:
+        success, error = database_future.result()
+        if not success:
+            print(f"⚠️  Gagal koneksi otomatis: {error}")
+            print(
+                "💡 Silakan input database connection secara manual di web interface"
+            )
+
+    return True
+
+
+if __name__ == "__main__":
+    # Development server; untuk production jalankan: gunicorn app:app
+    if initialize_app():
+        print("\n🚀 Starting Flask server...")
         app.run(debug=True)
     else:
         print("❌ Gagal menjalankan aplikasi. Silakan periksa konfigurasi OpenAI Anda.")
@@ -0,0 +1,25 @@
+# Konfigurasi Gunicorn untuk web app, jalankan dari folder web: gunicorn app:app
+import os
+
+bind = os.getenv("GUNICORN_BIND", "127.0.0.1:8000")
+
+# Koneksi database yang dipilih lewat form /connect disimpan per proses,
+# jadi default-nya satu worker. Naikkan WEB_CONCURRENCY (mis. 2 * CPU + 1)
+# hanya jika DATABASE_URL sudah diset di .env untuk semua worker.
+workers = int(os.getenv("WEB_CONCURRENCY", 1))
+
+# Request didominasi menunggu LLM (I/O), thread per worker membuat request overlap
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", 16))
+
+# Panggilan LLM bisa lama, jangan sampai worker di-kill di tengah request
+timeout = 120
+keepalive = 75
+
+
+def post_fork(server, worker):
+    """Setiap worker membuat OpenAI client, connection pool, dan engine sendiri"""
+    import app
+
+    if not app.initialize_app():
+        raise RuntimeError("Gagal inisialisasi OpenAI client")